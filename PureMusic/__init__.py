@@ -1,5 +1,6 @@
 #!/usr/bin/python
 
 from .notes import *
-from .score import Score, load, ScoreError, play
-from .tunage import EqTemp, teiltone
\ No newline at end of file
+from .score import Score, SpecScore, load, ScoreError, play
+from .cost import calibrate, load_calibration
+from .tunage import EqTemp, temperament, teiltone, TuneError
\ No newline at end of file
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+import json
+import time
+import tracemalloc
+import numpy as np
+from . import notes
+from . import spectral
+from . import dynamics
+
+'''
+cost.py
+
+Predicts the time and memory needed to render a score from its note specs alone,
+either held in a Score or streamed through pipeline.export
+Predictions come from a calibration dict, which calibrate() refreshes by timing the wave
+functions on this machine, and which can be saved/loaded as .json
+'''
+
+''' Seconds per synthesized sample, and bytes per note sample of the render temporaries '''
+CALIBRATION = {
+    'wave': {
+        'sine': 2.0e-8,
+        'ramp': 2.0e-8,
+        'noise': 1.5e-8,
+        'any_acc': 2.2e-8,
+        'gliss_sine': 4.0e-8,
+        'gliss_sine_acc': 4.2e-8,
+        'gliss_ramp': 4.0e-8,
+    },
+    'spectral': 3.0e-9,
+    'note': 6.0e-9,
+    'mix': 1.5e-9,
+    'export': 3.0e-9,
+    'note_tmp_bytes': {
+        'sine': 16,
+        'ramp': 16,
+        'noise': 24,
+        'any_acc': 20,
+        'gliss_sine': 24,
+        'gliss_sine_acc': 28,
+        'gliss_ramp': 24,
+    },
+    'spectral_tmp_bytes': 36,
+    'export_tmp_bytes': 14,
+}
+
+''' Waves which synthesize each partial of 'over' as well as the fundamental '''
+PARTIAL_WAVES = ('any_acc', 'gliss_sine_acc')
+''' Waves which glide from freq to freq2 '''
+GLISS_WAVES = ('gliss_sine', 'gliss_sine_acc', 'gliss_ramp')
+
+SAMPLE_BYTES = np.dtype(np.float32).itemsize
+
+def note_samples(note_j: dict, rate: int) -> int:
+    '''
+    Number of samples a note renders to, matching np.arange(rate*dur)
+    '''
+    return max(int(np.ceil(rate*note_j['dur'])), 0)
+
+def synth_samples(note_j: dict, rate: int) -> int:
+    '''
+    Number of samples synthesized for a note, counting every overtone partial
+    '''
+    partials = 1 + len(note_j['over']) if note_j['wave'] in PARTIAL_WAVES else 1
+    return note_samples(note_j, rate) * partials
+
+def uses_spectral(note_j: dict, rate: int) -> bool:
+    '''
+    Whether a note is synthesized by spectral.partials, as decided in notes.py
+    '''
+    if note_j['wave'] not in PARTIAL_WAVES:
+        return False
+    freq2 = note_j['freq2'] if note_j['wave'] in GLISS_WAVES else note_j['freq']
+    return notes._use_spectral(note_j['freq'], freq2, note_j['dur'], rate, note_j['over'])
+
+def estimate(notes_j: list, rate: int, end: float, calib: dict =None,
+             streamed: bool =False, max_memory: int =None) -> dict:
+    '''
+    Estimates render cost of notes without synthesizing them
+
+    Args:
+        notes_j: list -> note dictionaries, as in Score.notes_j
+        rate: int -> sample rate Hz
+        end: float -> end time of score in seconds
+        calib: dict or None -> calibration, defaults to CALIBRATION
+        streamed: bool -> predict pipeline.export instead of a Score holding every note
+                          and the canvas
+        max_memory: int or None -> memory budget, as given to Score or pipeline.export
+    Returns:
+        dict of sample counts, byte counts and predicted seconds
+    I/O:
+        None
+    '''
+    from . import pipeline
+
+    calib = calib or CALIBRATION
+    total = int(end*rate)
+
+    wave_samples = {}
+    note_bytes = 0
+    note_tmp = 0
+    widths = []
+    render_s = 0.0
+    for note_j in notes_j:
+        spl = note_samples(note_j, rate)
+        syn = synth_samples(note_j, rate)
+        wave_samples[note_j['wave']] = wave_samples.get(note_j['wave'], 0) + syn
+        note_bytes += spl * SAMPLE_BYTES
+        widths.append(spl)
+        if uses_spectral(note_j, rate):
+            render_s += syn * calib['spectral']
+            note_tmp = max(note_tmp, spl * calib['spectral_tmp_bytes'])
+        else:
+            render_s += syn * calib['wave'].get(note_j['wave'], max(calib['wave'].values()))
+            note_tmp = max(note_tmp, spl * calib['note_tmp_bytes'].get(
+                note_j['wave'], max(calib['note_tmp_bytes'].values())))
+        render_s += spl * calib['note']
+
+    canvas_bytes = total * SAMPLE_BYTES
+    export_tmp = min(total, dynamics.BLOCK) * calib['export_tmp_bytes']
+    longest = max(widths, default=0) * SAMPLE_BYTES
+    window = longest + dynamics.BLOCK * SAMPLE_BYTES
+    if streamed:
+        # rendered notes wait in the synthesis pool and the queue to the mixer, the mixer
+        # holds a window of the longest note and a block, and blocks queue for the writer
+        widths.sort(reverse=True)
+        held = sum(widths[:2*pipeline.DEPTH + 1]) * SAMPLE_BYTES
+        if max_memory is not None:
+            # a note over the budget still goes once nothing else is held
+            held = min(held, max(max_memory, longest))
+        queued = pipeline.DEPTH * dynamics.BLOCK * SAMPLE_BYTES
+        peak = held + window + queued + pipeline.WORKERS*note_tmp + export_tmp
+    else:
+        held = note_bytes + canvas_bytes
+        if max_memory is not None and canvas_bytes + longest <= max_memory:
+            held = min(held, max_memory)
+        elif max_memory is not None:
+            # the mix streams in chunks, holding notes beside a window and one note
+            held = min(note_bytes + window + longest, max(max_memory, window + longest))
+        peak = held + max(note_tmp, export_tmp)
+
+    render_s += total * calib['mix']
+    return {
+        'total_samples': total,
+        'synth_samples': wave_samples,
+        'note_bytes': note_bytes,
+        'canvas_bytes': canvas_bytes,
+        'peak_bytes': peak,
+        'streamed': streamed,
+        'max_memory': max_memory,
+        'render_seconds': render_s,
+        'export_seconds': render_s + total * calib['export'],
+    }
+
+def calibrate(rate: int =44100, dur: float =2.0) -> dict:
+    '''
+    Times every wave function and the mix/export steps to refresh the calibration
+
+    Args:
+        rate: int -> sample rate Hz
+        dur: float -> seconds of audio synthesized per measurement
+    Returns:
+        calibration dict, in the form of CALIBRATION
+    I/O:
+        None
+    '''
+    from .score import Score
+
+    over = [[2, 0.5], [3, 0.25]]
+    calib = {'wave': {}, 'note_tmp_bytes': {}}
+    spl = note_samples({'dur': dur}, rate)
+
+    for name in CALIBRATION['wave']:
+        wave = getattr(notes, name)
+        # over is below the default SPECTRAL_PARTIALS, so this times the time domain path
+        syn = synth_samples({'dur': dur, 'over': over, 'wave': name}, rate)
+        t0 = time.perf_counter()
+        wave(440.0, dur, 0.5, rate, over, 550.0)
+        calib['wave'][name] = (time.perf_counter() - t0) / syn
+
+        tracemalloc.start()
+        wave(440.0, dur, 0.5, rate, over, 550.0)
+        calib['note_tmp_bytes'][name] = tracemalloc.get_traced_memory()[1] // spl
+        tracemalloc.stop()
+
+    # glides need shorter frames, so the slower of a steady and a one octave glide is kept
+    spectral_s = max(result[2] for glide in (1.0, 2.0)
+                     for result in spectral.benchmark((32,), dur, rate, glide))
+    calib['spectral'] = spectral_s / (32 * spl)
+
+    over = [[partial, 0.5/partial] for partial in range(2, 33)]
+    tracemalloc.start()
+    notes._spectral_acc(110.0, 220.0, dur, 0.5, rate, over)
+    calib['spectral_tmp_bytes'] = tracemalloc.get_traced_memory()[1] // spl
+    tracemalloc.stop()
+
+    wv = notes.sine(440.0, dur, 0.5, rate)
+    t0 = time.perf_counter()
+    notes.cresc(notes.rectangular(wv, rate), rate)
+    calib['note'] = (time.perf_counter() - t0) / spl
+
+    scr = Score(rate)
+    scr.add(440.0, dur, 0.5)
+    t0 = time.perf_counter()
+    scr._mix()
+    calib['mix'] = (time.perf_counter() - t0) / spl
+
+    tracemalloc.start()
+    dynamics.encode(scr._mix()[:dynamics.BLOCK])
+    calib['export_tmp_bytes'] = tracemalloc.get_traced_memory()[1] // min(spl, dynamics.BLOCK)
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    for block in dynamics.blocks(scr._mix()):
+        dynamics.encode(block)
+    calib['export'] = (time.perf_counter() - t0) / spl
+
+    return calib
+
+def load_calibration(path: str) -> dict:
+    '''
+    Loads a calibration saved as .json, filling missing values from CALIBRATION
+    '''
+    with open(path, 'r') as jobj:
+        loaded = json.load(jobj)
+
+    calib = dict(CALIBRATION, **loaded)
+    for key in ('wave', 'note_tmp_bytes'):
+        # calibrations from before note_tmp_bytes was per wave hold a single number
+        per_wave = loaded.get(key) if isinstance(loaded.get(key), dict) else {}
+        calib[key] = dict(CALIBRATION[key], **per_wave)
+    return calib
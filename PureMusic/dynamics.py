@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import numpy as np
+
+'''
+dynamics.py
+
+Output stage between the mixed canvas and the speakers or .wav
+All functions work on iterables of float32 blocks, so memory stays bounded by the block
+size however long the output is
+'''
+
+BLOCK = 4096
+
+class DynamicsError(Exception):
+    pass
+
+def blocks(cvs: np.ndarray, size: int =BLOCK):
+    '''
+    Yields views of cvs in blocks of size samples
+    '''
+    for start in range(0, len(cvs), size):
+        yield cvs[start:start+size]
+
+def block_peaks(cvs: np.ndarray, size: int =BLOCK) -> np.ndarray:
+    '''
+    Peak absolute sample of each block of cvs
+    '''
+    if len(cvs) == 0:
+        return np.zeros((0,), dtype=np.float32)
+    return np.maximum.reduceat(np.abs(cvs), np.arange(0, len(cvs), size))
+
+def scale(stream, gain: float):
+    '''
+    Yields blocks multiplied by gain
+    '''
+    for block in stream:
+        yield (block * gain).astype(np.float32)
+
+def limit(stream, rate: int =44100, ceiling: float =0.99, lookahead: float =0.005,
+          release: float =0.05):
+    '''
+    Single pass look-ahead limiter
+
+    The gain is set at the edges of lookahead sized sub-blocks to the lowest gain that keeps
+    both neighbouring sub-blocks under ceiling, rises by at most one sub-block per release
+    seconds, and is interpolated linearly in between, so no sample exceeds ceiling
+
+    Args:
+        stream: iterable -> float32 ndarray blocks of any size
+        rate: int -> sample rate Hz
+        ceiling: float -> highest absolute sample allowed in output
+        lookahead: float -> seconds of look-ahead, also the length of the gain ramps
+        release: float -> seconds for the gain to recover from 0 to 1
+    Returns:
+        generator of float32 ndarray blocks, same total length as stream
+    I/O:
+        None
+    '''
+    if ceiling <= 0.0 or lookahead <= 0.0 or release <= 0.0:
+        raise DynamicsError
+
+    sub = max(int(rate*lookahead), 1)
+    step = sub / (rate*release)
+    ramp = np.arange(sub, dtype=np.float32) / sub
+    held = np.zeros((0,), dtype=np.float32)
+    gain = None
+    last_req = 1.0
+    stream = iter(stream)
+
+    while True:
+        block = next(stream, None)
+        if block is None:
+            # pad to whole sub-blocks, plus a silent one so every sample is emitted
+            length = len(held)
+            held = np.concatenate((held, np.zeros(((-length) % sub + sub,), dtype=np.float32)))
+        else:
+            held = np.concatenate((held, np.asarray(block, dtype=np.float32)))
+
+        nsub = len(held) // sub
+        if nsub >= 2:
+            subs = held[:nsub*sub].reshape(nsub, sub)
+            req = np.minimum(1.0, ceiling / np.maximum(np.abs(subs).max(axis=1), 1e-12))
+            # gain at the start of each sub-block, the first was fixed on the last pass
+            edge = np.minimum(np.concatenate(([last_req], req[:-1])), req)
+            if gain is not None:
+                edge[0] = gain
+            k = np.arange(nsub)
+            edge = np.minimum.accumulate(edge - k*step) + k*step
+
+            env = edge[:-1, None] + (edge[1:] - edge[:-1])[:, None] * ramp
+            out = (subs[:-1] * env).ravel().astype(np.float32)
+            gain = edge[-1]
+            last_req = req[-2]
+            held = held[(nsub-1)*sub:]
+
+            if block is None:
+                yield out[:length]
+            else:
+                yield out
+
+        if block is None:
+            return
+
+def encode(block: np.ndarray) -> bytes:
+    '''
+    Converts a float block to 16 bit .wav frames, clipping at full scale
+    '''
+    return (np.clip(block, -1.0, 1.0) * 32767).astype('<i2').tobytes()
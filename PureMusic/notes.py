@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import numpy as np
+from . import spectral
 
 '''
 notes.py
@@ -10,6 +11,12 @@ all functions in a set take the same arguments to make function switching easier
 
 VOLU = 0.2
 
+''' Overtone waves with at least this many partials (fundamental included) use spectral
+synthesis, None always uses the time domain '''
+SPECTRAL_PARTIALS = 8
+''' Glides so fast that spectral frames would be shorter than this use the time domain '''
+SPECTRAL_MIN_FRAME = spectral.FRAME // 4
+
 class WaveError(Exception):
     pass
 
@@ -50,6 +57,8 @@ def any_acc(freq: float =330.0, dur: float =1.0, vol: float =0.5, rate: int =441
     '''
     if vol > 1.0 or freq < 0.0:
         raise WaveError
+    if _use_spectral(freq, freq, dur, rate, over):
+        return _spectral_acc(freq, freq, dur, vol, rate, over)
     wave = sine(freq, dur, vol, rate, over, freq2)
 
     for partial, volmod in over:
@@ -76,6 +85,8 @@ def gliss_sine_acc(freq: float =440.0, dur: float =1.0, vol: float =0.5, rate: i
     '''
     if vol > 1.0 or freq < 0.0 or freq2 < 0.0:
         raise WaveError
+    if _use_spectral(freq, freq2, dur, rate, over):
+        return _spectral_acc(freq, freq2, dur, vol, rate, over)
     wave = gliss_sine(freq, dur, vol, rate, over, freq2)
 
     for partial, volmod in over:
@@ -95,6 +106,29 @@ def gliss_ramp(freq: float =440.0, dur: float =1.0, vol: float =0.5, rate: int =
 	return ((VOLU*vol) * np.mod(np.multiply(np.arange(rate*dur),
 			np.linspace(freq, rfreq2, int(dur*rate)))/(2*rate), 1.0)).astype(np.float32)
 
+def _use_spectral(freq: float, freq2: float, dur: float, rate: int, over: list) -> bool:
+    '''
+    Whether an overtone wave has enough partials for spectral synthesis, and glides slowly
+    enough for its frames to stay long
+    '''
+    if SPECTRAL_PARTIALS is None or len(over) + 1 < SPECTRAL_PARTIALS:
+        return False
+    parts = np.array([1.0] + [partial for partial, volmod in over], dtype=np.float64)
+    return spectral.frame_size(freq*parts, freq2*parts, int(np.ceil(rate*dur)),
+                               rate) >= SPECTRAL_MIN_FRAME
+
+def _spectral_acc(freq: float, freq2: float, dur: float, vol: float, rate: int, over: list):
+    '''
+    Sine or gliss sine wave with overtone, synthesized by spectral.partials
+    Partials above rate/2 are left out instead of aliasing
+    '''
+    parts = np.array([[1.0, 1.0]] + [[partial, volmod] for partial, volmod in over],
+                     dtype=np.float64)
+    if np.any(vol*parts[:, 1] > 1.0) or np.any(parts[:, 0] < 0.0):
+        raise WaveError
+    return spectral.partials(freq*parts[:, 0], freq2*parts[:, 0], VOLU*vol*parts[:, 1],
+                             len(np.arange(rate*dur)), rate)
+
 ''' TODO: ramp with overtone, square wave, others? '''
 
 ''' Envelope functions '''
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+import os
+import wave
+import queue
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+from . import cost
+from . import dynamics
+from .score import render_note, mix_sorted
+
+'''
+pipeline.py
+
+Exports to .wav with parsing, note synthesis, mixing and encoding running at once
+Stages are threads joined by bounded queues, so a fast stage waits for a slow one instead of
+piling up work, and wall time approaches that of the slowest stage
+Notes must arrive in order of start, so every sample before the latest start is final
+and can be passed on while later notes are still being synthesized
+pmlc's sources read, resolve and sort the whole file before the first note, so parsing is
+a serial prefix and only synthesis, mixing and writing overlap
+'''
+
+DEPTH = 64
+SAMPLE_BYTES = np.dtype(np.float32).itemsize
+WORKERS = min(os.cpu_count() or 1, 4)
+
+_DONE = object()
+
+class PipelineError(Exception):
+    pass
+
+class _Stop(Exception):
+    pass
+
+class _Budget(object):
+    ''' Bytes of rendered notes not yet mixed, waiting for room past max_memory '''
+    def __init__(self, max_memory: int =None):
+        self.max_memory = max_memory
+        self.held = 0
+        self.peak = 0
+        self.cond = threading.Condition()
+
+    def fits(self, nbytes: int) -> bool:
+        # a note bigger than the budget still goes once nothing else is held
+        return self.max_memory is None or self.held == 0 or self.held + nbytes <= self.max_memory
+
+    def acquire(self, nbytes: int, stop: threading.Event):
+        with self.cond:
+            while not self.fits(nbytes):
+                if stop.is_set():
+                    raise _Stop
+                self.cond.wait(0.1)
+            self.held += nbytes
+            self.peak = max(self.peak, self.held)
+
+    def release(self, nbytes: int):
+        with self.cond:
+            self.held -= nbytes
+            self.cond.notify_all()
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    ''' put which gives up once another stage has failed '''
+    while True:
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            if stop.is_set():
+                raise _Stop
+
+def _items(q: queue.Queue, stop: threading.Event):
+    ''' yields items of q until _DONE, gives up once another stage has failed '''
+    while True:
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                raise _Stop
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+def _stage(target, errors: list, stop: threading.Event, *args) -> threading.Thread:
+    ''' starts target in a thread, recording its exception and stopping the others '''
+    def run():
+        try:
+            target(*args)
+        except _Stop:
+            pass
+        except BaseException as exc:
+            errors.append(exc)
+            stop.set()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def _parse(source, outq: queue.Queue, stop: threading.Event):
+    '''
+    parse stage, passes on the sample rate then the note dicts from source
+    '''
+    last = 0.0
+    for item in source:
+        if isinstance(item, dict):
+            if item['start'] < last:
+                raise PipelineError('notes must be in order of start')
+            last = item['start']
+        _put(outq, item, stop)
+    _put(outq, _DONE, stop)
+
+def _synth(inq: queue.Queue, outq: queue.Queue, stop: threading.Event, workers: int, depth: int,
+           budget: _Budget):
+    '''
+    synthesis stage, renders notes on a pool of threads and passes on (note, samples) in order
+    '''
+    items = _items(inq, stop)
+    rate = next(items)
+    _put(outq, rate, stop)
+
+    if workers <= 1:
+        for note_j in items:
+            budget.acquire(cost.note_samples(note_j, rate) * SAMPLE_BYTES, stop)
+            _put(outq, (note_j, render_note(note_j, rate)), stop)
+        _put(outq, _DONE, stop)
+        return
+
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        for note_j in items:
+            nbytes = cost.note_samples(note_j, rate) * SAMPLE_BYTES
+            # notes held here are only released once mixed, so pass them on before waiting
+            while pending and not budget.fits(nbytes):
+                note_p, fut = pending.popleft()
+                _put(outq, (note_p, fut.result()), stop)
+            budget.acquire(nbytes, stop)
+            pending.append((note_j, pool.submit(render_note, note_j, rate)))
+            if len(pending) >= depth:
+                note_j, fut = pending.popleft()
+                _put(outq, (note_j, fut.result()), stop)
+        while pending:
+            note_j, fut = pending.popleft()
+            _put(outq, (note_j, fut.result()), stop)
+    _put(outq, _DONE, stop)
+
+def _mix(inq: queue.Queue, outq: queue.Queue, stop: threading.Event, budget: _Budget,
+         stats: dict):
+    '''
+    mixing stage, adds notes into a window of the canvas and passes on the blocks before the
+    latest start, which no later note can change
+    '''
+    items = _items(inq, stop)
+    rate = next(items)
+    _put(outq, rate, stop)
+
+    def pairs():
+        # mix_sorted asks for the next note once this one is mixed, so its bytes are
+        # released before waiting on the queue
+        for note_j, samples in items:
+            stats['window_bytes'] = max(stats['window_bytes'], samples.nbytes)
+            yield note_j, samples
+            budget.release(cost.note_samples(note_j, rate) * SAMPLE_BYTES)
+
+    for block in mix_sorted(pairs(), rate):
+        _put(outq, block, stop)
+    _put(outq, _DONE, stop)
+
+def export(source, path: str, gain: float =1.0, limit: float =None, workers: int =WORKERS,
+           depth: int =DEPTH, max_memory: int =None) -> dict:
+    '''
+    Exports notes to 16 bit .wav with all stages running at once
+
+    Args:
+        source: iterable -> sample rate first, then note dicts (as Score.notes_j) in order
+                            of start, it is consumed in the parse stage thread
+        path: str -> output path to .wav
+        gain: float -> gain applied to every sample
+        limit: float or None -> look-ahead limits to this ceiling after gain
+        workers: int -> number of note synthesis threads
+        depth: int -> size of the queues between stages
+        max_memory: int or None -> bytes of rendered notes waiting to be mixed, synthesis
+                                   waits for the mixer past this
+    Returns:
+        dict of peak bytes held by rendered notes, the mix window, queued blocks and in total,
+        and whether the rendered notes went over max_memory
+    I/O:
+        writes path.wav
+    '''
+    if not path.endswith('.wav'):
+        path += '.wav'
+
+    stop = threading.Event()
+    errors = []
+    budget = _Budget(max_memory)
+    stats = {'window_bytes': 0}
+    notes_q = queue.Queue(depth)
+    synth_q = queue.Queue(depth)
+    mix_q = queue.Queue(depth)
+    threads = [
+        _stage(_parse, errors, stop, source, notes_q, stop),
+        _stage(_synth, errors, stop, notes_q, synth_q, stop, workers, depth, budget),
+        _stage(_mix, errors, stop, synth_q, mix_q, stop, budget, stats),
+    ]
+
+    # encoding and writing run on this thread
+    try:
+        items = _items(mix_q, stop)
+        rate = next(items, None)
+        if rate is not None:
+            stream = items
+            if gain != 1.0:
+                stream = dynamics.scale(stream, gain)
+            if limit is not None:
+                stream = dynamics.limit(stream, rate, limit)
+
+            with wave.open(path, 'wb') as wv:
+                wv.setparams((1, 2, rate, 0, "NONE", "not compressed"))
+                for block in stream:
+                    wv.writeframes(dynamics.encode(block))
+    except _Stop:
+        pass
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    # the window holds at most the longest note and one block
+    window = stats['window_bytes'] + dynamics.BLOCK * SAMPLE_BYTES
+    queued = depth * dynamics.BLOCK * SAMPLE_BYTES
+    return {
+        'note_bytes': budget.peak,
+        'window_bytes': window,
+        'queue_bytes': queued,
+        'peak_bytes': budget.peak + window + queued,
+        'max_memory': max_memory,
+        'over_budget': max_memory is not None and budget.peak > max_memory,
+    }
@@ -2,10 +2,11 @@
 import os
 import json
 import wave
-import struct
-import pyaudio
+import tempfile
 import numpy as np
 from . import notes
+from . import cost
+from . import dynamics
 
 '''
 score.py
@@ -17,6 +18,9 @@ Can be stored or loaded as a .pmusic file, a .json filetype
 
 PM_EXT = '.pmusic'
 
+''' Waves which are not the same when rendered again, so are spilled to disk, not evicted '''
+SPILL_WAVES = ('noise',)
+
 class ScoreError(Exception):
     pass
 
@@ -40,14 +44,76 @@ def render_note(note_j: dict, rate: int) -> np.ndarray:
                    rate, note_j['attc'], note_j['dec']), rate, note_j['to'],
                    note_j['start_d'], note_j['end_d'])
 
+def mix_sorted(pairs, rate: int, end: float =None):
+    '''
+    Mixes notes in order of start, yielding each dynamics.BLOCK once no later note can change it
+
+    Args:
+        pairs: iterable -> (note dict, rendered ndarray) in order of start
+        rate: int -> sample rate Hz
+        end: float or None -> end time of the mix, None for the end of the last note
+    Returns:
+        generator of float32 ndarray blocks, only a window of the canvas is held
+    I/O:
+        None
+    '''
+    base = 0
+    window = np.zeros((0,), dtype=np.float32)
+    last = 0.0
+    for note_j, samples in pairs:
+        start_spl = int(rate * note_j['start'])
+        last = max(last, note_j['start'] + note_j['dur'])
+        while start_spl - base >= dynamics.BLOCK:
+            # silence before the next note has no samples in the window yet
+            if len(window) < dynamics.BLOCK:
+                window = np.concatenate((window, np.zeros((dynamics.BLOCK-len(window),),
+                                                          dtype=np.float32)))
+            yield window[:dynamics.BLOCK].copy()
+            window = window[dynamics.BLOCK:]
+            base += dynamics.BLOCK
+
+        grow = start_spl + len(samples) - base - len(window)
+        if grow > 0:
+            window = np.concatenate((window, np.zeros((grow,), dtype=np.float32)))
+        window[start_spl-base:start_spl-base+len(samples)] += samples
+
+    # the canvas ends at end, cutting or padding the last notes
+    length = max(int((last if end is None else end)*rate) - base, 0)
+    if length > len(window):
+        window = np.concatenate((window, np.zeros((length-len(window),), dtype=np.float32)))
+    for block in dynamics.blocks(window[:length]):
+        yield block
+
+def _check_note(note_j: dict):
+    '''
+    Raises ScoreError if a note dictionary names unknown note functions or starts before 0
+    '''
+    for key in ('wave', 'envelope', 'dyn'):
+        if not hasattr(notes, note_j[key]):
+            raise ScoreError
+    if note_j['start'] < 0.0:
+        raise ScoreError
+
 class Score(object):
-    ''' Stores data for a given project and handles operations '''
-    def __init__(self, rate: int =44100, title: str ='untitled'):
+    '''
+    Stores data for a given project and handles operations
+    With max_memory set (bytes), rendered notes are evicted (or spilled to disk) oldest first
+    to stay under it, and rendering streams in chunks if the canvas alone would not fit
+    '''
+    def __init__(self, rate: int =44100, title: str ='untitled', max_memory: int =None):
         self.rate = rate
         self.title = title
+        self.max_memory = max_memory
         self.notes_j = []
         self.notes_b = []
         self.end = 0.0
+        self._cvs = None
+        self._peaks = None
+        self._note_bytes = 0
+        self._peak_bytes = 0
+        self._evict_from = 0
+        self._spill = None
+        self._spills = 0
 
     def add(self, freq: float, dur: float, vol: float, attc: float =0.05, dec: float =0.05,
             over: list =[], wave: str ='sine', envelope: str ='rectangular', dyn: str ='no_dyn',
@@ -62,9 +128,6 @@ class Score(object):
         I/O:
             None
         '''
-        if not hasattr(notes, wave) or not hasattr(notes, envelope) or not hasattr(notes, dyn):
-            raise ScoreError
-
         new_note = {
             'freq': freq,
             'dur': dur,
@@ -81,12 +144,85 @@ class Score(object):
             'start_d': start_d,
             'end_d': end_d,
         }
+        _check_note(new_note)
+        self._append(new_note)
+
+    def _append(self, note_j: dict):
+        '''
+        renders a checked note and mixes it in at the end of notes_j
+        '''
+        self._fit(cost.note_samples(note_j, self.rate) * np.dtype(np.float32).itemsize)
+        note_b = render_note(note_j, self.rate)
+        self._track(note_b.nbytes)
+        self.notes_j.append(note_j)
+        self.notes_b.append(note_b)
+        self._note_bytes += note_b.nbytes
+        self._resize(max(self.end, note_j['dur'] + note_j['start']), len(self.notes_j)-1)
+        self._place(-1, 1.0)
+        self._fit()
+
+    def remove(self, idx: int) -> dict:
+        '''
+        Removes a note, subtracting it from the mixed canvas
+
+        Args:
+            idx: int -> index of note in notes_j
+        Returns:
+            dict of the removed note kws
+        I/O:
+            None
+        '''
+        idx %= len(self.notes_j)
+        self._place(idx, -1.0)
+        self._drop(idx)
+        note_j = self.notes_j.pop(idx)
+        self.notes_b.pop(idx)
+        if idx < self._evict_from:
+            self._evict_from -= 1
+        self._resize(max((n['start'] + n['dur'] for n in self.notes_j), default=0.0))
+        return note_j
+
+    def replace(self, idx: int, **changes):
+        '''
+        Changes kws of a note, re-rendering only that note
+
+        Args:
+            idx: int -> index of note in notes_j
+            **changes -> note kws to be changed, as in add
+        Returns:
+            None
+        I/O:
+            None
+        '''
+        if any(key not in self.notes_j[idx] for key in changes):
+            raise ScoreError
+        new_note = dict(self.notes_j[idx], **changes)
+        _check_note(new_note)
+
+        # only the position changed, the rendered (or evicted) note can be reused
+        new_b = None
+        if not all(key == 'start' for key in changes):
+            self._fit(cost.note_samples(new_note, self.rate) * np.dtype(np.float32).itemsize)
+            new_b = render_note(new_note, self.rate)
+            self._track(new_b.nbytes)
 
-        if dur + start > self.end:
-            self.end = dur + start
+        self._place(idx, -1.0)
+        self.notes_j[idx] = new_note
+        if new_b is not None:
+            self._drop(idx)
+            self.notes_b[idx] = new_b
+            self._note_bytes += new_b.nbytes
+            self._evict_from = min(self._evict_from, idx % len(self.notes_b))
+        self._resize(max((n['start'] + n['dur'] for n in self.notes_j), default=0.0),
+                     idx % len(self.notes_j))
+        self._place(idx, 1.0)
+        self._fit()
 
-        self.notes_j.append(new_note)
-        self.notes_b.append(render_note(new_note, self.rate))
+    def shift(self, idx: int, dt: float):
+        '''
+        Moves a note dt seconds later (or earlier if dt negative)
+        '''
+        self.replace(idx, start=self.notes_j[idx]['start'] + dt)
 
     def add_trill(self, freq1: float, freq2: float, length: float, num: int, vol: float, attc: float =0.01, 
                   dec: float =0.01, over: list =[], wave: str ='sine', envelope: str ='rectangular',
@@ -101,25 +237,265 @@ class Score(object):
             self.add(freq, ind_dur, vol, attc, dec, over, wave, envelope, dyn, this_s, to, start_d, end_d)
             this_s += ind_dur
 
-    def _pad(self, idx: int) -> np.ndarray:
+    def _place(self, idx: int, sign: float, from_spl: int =0):
         '''
-        pads a note to have empty sound an either side
+        adds (sign 1.0) or subtracts (sign -1.0) a note from the cached canvas,
+        only the samples from from_spl on, the canvas cuts off the rest
         '''
+        if self._cvs is None:
+            return
+        note_b = self._buffer(idx)
         start_spl = int(self.rate * self.notes_j[idx]['start'])
-        end_spl = int(self.end * self.rate) - (start_spl + len(self.notes_b[idx]))
-        begin = np.zeros((start_spl,), dtype=np.float32)
-        endd = np.zeros((end_spl,), dtype=np.float32)
-        return np.concatenate((begin, self.notes_b[idx], endd))
+        from_spl = max(start_spl, from_spl)
+        end_spl = min(start_spl + len(note_b), len(self._cvs))
+        if end_spl > from_spl:
+            self._cvs[from_spl:end_spl] += sign * note_b[from_spl-start_spl:end_spl-start_spl]
+            self._update_peaks(from_spl, end_spl)
 
-    def render(self) -> bytes:
+    def _buffer(self, idx: int, extra: int =0) -> np.ndarray:
         '''
-        Returns bytes from all notes in timing
+        returns the rendered note, loading it if spilled or rendering it again if evicted
         '''
-        cvs = np.zeros(int(self.end*self.rate), dtype=np.float32)
-        for idx in range(len(self.notes_j)):
-            cvs += self._pad(idx)
-        
-        return cvs.tobytes()
+        note_b = self.notes_b[idx]
+        if isinstance(note_b, np.ndarray):
+            return note_b
+        note_b = np.load(note_b) if isinstance(note_b, str) else render_note(self.notes_j[idx],
+                                                                               self.rate)
+        self._track(note_b.nbytes + extra)
+        return note_b
+
+    def _drop(self, idx: int):
+        '''
+        forgets the rendered note, whether held or spilled
+        '''
+        note_b = self.notes_b[idx]
+        if isinstance(note_b, np.ndarray):
+            self._note_bytes -= note_b.nbytes
+        elif isinstance(note_b, str):
+            os.remove(note_b)
+        self.notes_b[idx] = None
+
+    def _evict(self, idx: int):
+        '''
+        frees a held rendered note, spilling it to disk if it cannot be rendered again
+        '''
+        note_b = self.notes_b[idx]
+        if not isinstance(note_b, np.ndarray):
+            return
+        if self.notes_j[idx]['wave'] in SPILL_WAVES:
+            if self._spill is None:
+                self._spill = tempfile.TemporaryDirectory(prefix='puremusic')
+            path = os.path.join(self._spill.name, '{}.npy'.format(self._spills))
+            self._spills += 1
+            np.save(path, note_b)
+            self.notes_b[idx] = path
+        else:
+            self.notes_b[idx] = None
+        self._note_bytes -= note_b.nbytes
+
+    def _held(self) -> int:
+        '''
+        bytes held by rendered notes, the canvas and its peaks
+        '''
+        if self._cvs is None:
+            return self._note_bytes
+        return self._note_bytes + self._cvs.nbytes + self._peaks.nbytes
+
+    def _track(self, extra: int =0):
+        '''
+        records peak bytes, counting extra bytes held for a moment
+        '''
+        self._peak_bytes = max(self._peak_bytes, self._held() + extra)
+
+    def _fit(self, extra: int =0) -> bool:
+        '''
+        evicts rendered notes, oldest first, until extra more bytes fit in max_memory
+        '''
+        if self.max_memory is None:
+            return True
+        while self._held() + extra > self.max_memory and self._evict_from < len(self.notes_b):
+            self._evict(self._evict_from)
+            self._evict_from += 1
+        return self._held() + extra <= self.max_memory
+
+    def _canvas_fits(self) -> bool:
+        '''
+        whether the canvas and one evicted note rendered again fit in max_memory,
+        if not there is no point evicting notes
+        '''
+        return self.max_memory is None or self._canvas_need() <= self.max_memory
+
+    def _canvas_need(self) -> int:
+        '''
+        bytes the canvas needs, counting the longest note rendered again to mix it in
+        '''
+        return self._canvas_bytes() + self._longest_bytes()
+
+    def _longest_bytes(self) -> int:
+        '''
+        bytes of the longest rendered note
+        '''
+        return max((cost.note_samples(note_j, self.rate) for note_j in self.notes_j),
+                   default=0) * np.dtype(np.float32).itemsize
+
+    def _canvas_bytes(self) -> int:
+        '''
+        bytes the canvas and its peaks need
+        '''
+        length = int(self.end*self.rate)
+        return (length + -(-length // dynamics.BLOCK)) * np.dtype(np.float32).itemsize
+
+    def _update_peaks(self, start_spl: int, end_spl: int):
+        '''
+        recomputes the block peaks of the canvas between two samples
+        '''
+        first = start_spl // dynamics.BLOCK
+        last = -(-end_spl // dynamics.BLOCK)
+        self._peaks[first:last] = dynamics.block_peaks(
+            self._cvs[first*dynamics.BLOCK:last*dynamics.BLOCK])
+
+    def _resize(self, end: float, unplaced: int =None):
+        '''
+        grows or shrinks the cached canvas to a new end time
+        Growing mixes in again the samples of notes cut off at the old end, except for
+        the note at index unplaced, which is not on the canvas
+        '''
+        self.end = end
+        if self._cvs is None:
+            return
+        length = int(self.end*self.rate)
+        nblocks = -(-length // dynamics.BLOCK)
+        if length > len(self._cvs):
+            # the old canvas is held while the new one is built
+            if not self._canvas_fits() or not self._fit(self._canvas_need()):
+                self._cvs = None
+                self._peaks = None
+                return
+            self._track(self._canvas_bytes())
+            old = len(self._cvs)
+            self._cvs = np.concatenate((self._cvs,
+                                        np.zeros((length-old,), dtype=np.float32)))
+            self._peaks = np.concatenate((self._peaks,
+                                          np.zeros((nblocks-len(self._peaks),), dtype=np.float32)))
+            for idx, note_j in enumerate(self.notes_j):
+                if idx != unplaced and \
+                   int(self.rate*note_j['start']) + cost.note_samples(note_j, self.rate) > old:
+                    self._place(idx, 1.0, old)
+        elif length < len(self._cvs):
+            self._cvs = self._cvs[:length].copy()
+            self._peaks = self._peaks[:nblocks].copy()
+            self._update_peaks(max(length-1, 0), length)
+
+    def _mix(self) -> np.ndarray:
+        '''
+        returns the mixed canvas of all notes, mixing only when not cached,
+        or None when it would not fit in max_memory
+        '''
+        if self._cvs is None:
+            if not self._canvas_fits() or not self._fit(self._canvas_need()):
+                return None
+            self._cvs = np.zeros(int(self.end*self.rate), dtype=np.float32)
+            self._peaks = np.zeros((-(-len(self._cvs) // dynamics.BLOCK),), dtype=np.float32)
+            self._track()
+            for idx in range(len(self.notes_j)):
+                self._place(idx, 1.0)
+        return self._cvs
+
+    def _stream(self):
+        '''
+        yields the mix in blocks without a canvas, holding only a window and one note at a time
+        '''
+        order = sorted(range(len(self.notes_j)), key=lambda idx: self.notes_j[idx]['start'])
+        longest = self._longest_bytes()
+        window = longest + dynamics.BLOCK * np.dtype(np.float32).itemsize
+        # room for the window and a note rendered again to be mixed into it
+        self._fit(window + longest)
+        pairs = ((self.notes_j[idx], self._buffer(idx, window)) for idx in order)
+        return mix_sorted(pairs, self.rate, self.end)
+
+    def _blocks(self):
+        '''
+        yields the mix in blocks, from the canvas or streamed if it would not fit
+        '''
+        cvs = self._mix()
+        return self._stream() if cvs is None else dynamics.blocks(cvs)
+
+    def peaks(self) -> np.ndarray:
+        '''
+        Returns the peak absolute sample of each dynamics.BLOCK of the mixed canvas,
+        kept up to date as notes are mixed in and out
+        Without room for the canvas they are found by streaming the mix
+        '''
+        if self._mix() is None:
+            return np.array([block.max(initial=0.0) for block in
+                             map(np.abs, self._stream())], dtype=np.float32)
+        return self._peaks
+
+    def memory_stats(self) -> dict:
+        '''
+        Returns bytes held by rendered notes and the canvas, the peak bytes held (including
+        notes rendered for a moment) and whether it went over max_memory, how many notes are
+        held, spilled or evicted, and whether rendering will stream in chunks
+        '''
+        held = sum(isinstance(note_b, np.ndarray) for note_b in self.notes_b)
+        spilled = sum(isinstance(note_b, str) for note_b in self.notes_b)
+        return {
+            'note_bytes': self._note_bytes,
+            'canvas_bytes': 0 if self._cvs is None else self._cvs.nbytes + self._peaks.nbytes,
+            'total_bytes': self._held(),
+            'peak_bytes': self._peak_bytes,
+            'max_memory': self.max_memory,
+            'over_budget': self.max_memory is not None and self._peak_bytes > self.max_memory,
+            'notes_held': held,
+            'notes_spilled': spilled,
+            'notes_evicted': len(self.notes_b) - held - spilled,
+            'chunked': self._cvs is None and not self._canvas_fits(),
+        }
+
+    def _output(self, gain: float =1.0, normalize: float =None, limit: float =None):
+        '''
+        Yields blocks of the mixed canvas through the output stage
+
+        Args:
+            gain: float -> gain applied to every sample
+            normalize: float or None -> scales so the loudest sample is this (replaces gain)
+            limit: float or None -> look-ahead limits to this ceiling after gain
+        Returns:
+            generator of float32 ndarray blocks
+        I/O:
+            None
+        '''
+        if normalize is not None:
+            peak = float(self.peaks().max(initial=0.0))
+            gain = normalize / peak if peak > 0.0 else 1.0
+        stream = self._blocks()
+        if gain != 1.0:
+            stream = dynamics.scale(stream, gain)
+        if limit is not None:
+            stream = dynamics.limit(stream, self.rate, limit)
+        return stream
+
+    def render(self, gain: float =1.0, normalize: float =None, limit: float =None) -> bytes:
+        '''
+        Returns bytes from all notes in timing, through the output stage (see _output)
+        '''
+        return b''.join(block.tobytes() for block in self._output(gain, normalize, limit))
+
+    def estimate(self, calib: dict =None, streamed: bool =False) -> dict:
+        '''
+        Estimates samples, bytes and seconds to render this score from the note specs,
+        within max_memory
+
+        Args:
+            calib: dict or None -> calibration from cost.calibrate, defaults to cost.CALIBRATION
+            streamed: bool -> estimate exporting the notes through pipeline.export instead
+        Returns:
+            dict report from cost.estimate
+        I/O:
+            None
+        '''
+        return cost.estimate(self.notes_j, self.rate, self.end, calib, streamed,
+                             self.max_memory)
 
     def __repr__(self):
         d = {
@@ -137,29 +513,50 @@ class Score(object):
         with open(path, 'w') as out:
             out.write(self.__repr__())
 
-    def export(self, path: str):
+    def export(self, path: str, gain: float =1.0, normalize: float =None, limit: float =None):
+        '''
+        Writes 16 bit .wav block by block through the output stage (see _output)
+        Samples beyond full scale are clipped
+        '''
         if not path.endswith('.wav'):
             path += '.wav'
 
-        cvs = np.zeros(int(self.end*self.rate), dtype=np.float32)
-        for idx in range(len(self.notes_j)):
-            cvs += self._pad(idx)
-        audio = cvs.tolist()
-
         with wave.open(path, 'wb') as wv:
-            wv.setparams((1, 2, self.rate, len(audio),
+            wv.setparams((1, 2, self.rate, int(self.end*self.rate),
                           "NONE", "not compressed"))
-            for sample in audio:
-                wv.writeframes(struct.pack('h', int(sample*32767)))
+            for block in self._output(gain, normalize, limit):
+                wv.writeframes(dynamics.encode(block))
+
+class SpecScore(Score):
+    ''' Score which keeps note specs without synthesizing them, for estimates '''
+    def _append(self, note_j: dict):
+        self.notes_j.append(note_j)
+        self.end = max(self.end, note_j['dur'] + note_j['start'])
 
-def load(path: str) -> Score:
+    def remove(self, idx: int) -> dict:
+        note_j = self.notes_j.pop(idx)
+        self.end = max((n['start'] + n['dur'] for n in self.notes_j), default=0.0)
+        return note_j
+
+    def replace(self, idx: int, **changes):
+        if any(key not in self.notes_j[idx] for key in changes):
+            raise ScoreError
+        new_note = dict(self.notes_j[idx], **changes)
+        _check_note(new_note)
+        self.notes_j[idx] = new_note
+        self.end = max(n['start'] + n['dur'] for n in self.notes_j)
+
+    def _mix(self) -> np.ndarray:
+        raise ScoreError('SpecScore cannot be rendered')
+
+def load(path: str, specs: bool =False, max_memory: int =None) -> Score:
     if not os.path.exists(path) or not path.endswith(PM_EXT):
         raise ScoreError
     
     with open(path, 'r') as jobj:
         dict_s = json.load(jobj)
     
-    scr = Score(dict_s['rate'], dict_s['title'])
+    scr = (SpecScore if specs else Score)(dict_s['rate'], dict_s['title'], max_memory)
 
     for note in dict_s['notes']:
         scr.add(**note)
@@ -167,11 +564,14 @@ def load(path: str) -> Score:
     return scr
 
 def play(thing, rate=None):
+    import pyaudio
+
     if isinstance(thing, Score):
-        bstr = thing.render()
+        # written block by block, so a chunked score is never held whole
+        blocks = (block.tobytes() for block in thing._output())
         rate = thing.rate
     elif isinstance(thing, bytes):
-        bstr = thing
+        blocks = [thing]
         if rate is None:
             raise ScoreError
     else:
@@ -182,7 +582,8 @@ def play(thing, rate=None):
                      channels=1,
                      rate=rate,
                      output=True)
-    stream.write(bstr)
+    for bstr in blocks:
+        stream.write(bstr)
     stream.stop_stream()
     stream.close()
     pa.terminate()
\ No newline at end of file
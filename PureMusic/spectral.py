@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+import time
+import numpy as np
+
+'''
+spectral.py
+
+Spectral (inverse FFT, overlap-add) synthesis of many sine partials at once
+Each frame's spectrum is built from the partial list, only the bins around each partial
+are filled, so cost grows with partials * bins instead of partials * samples
+Used by notes.py for overtone waves with many partials
+'''
+
+FRAME = 1024
+MIN_FRAME = 64
+BINS = 8
+OVERSAMPLE = 64
+PHASE_ERR = 0.05
+CHUNK_CELLS = 2**15
+
+class SpectralError(Exception):
+    pass
+
+_kernels = {}
+
+def _kernel(frame: int) -> np.ndarray:
+    '''
+    table of the zero-phase Hann window transform, rows are fractional bin offsets
+    from -0.5 to 0.5 in OVERSAMPLE steps, columns are bins -BINS..BINS
+    '''
+    if frame not in _kernels:
+        frac = np.linspace(-0.5, 0.5, OVERSAMPLE+1)[:, None]
+        theta = 2*np.pi * (np.arange(-BINS, BINS+1) - frac) / frame
+        step = 2*np.pi/frame
+
+        def dirichlet(th):
+            # sum of cos(th*m) for m in -(frame/2-1)..frame/2-1
+            half = np.sin(th/2.0)
+            small = np.abs(half) < 1e-12
+            return np.where(small, frame-1, np.sin((frame-1)*th/2.0) / np.where(small, 1.0, half))
+
+        _kernels[frame] = (0.5*dirichlet(theta) + 0.25*dirichlet(theta-step) +
+                           0.25*dirichlet(theta+step))
+    return _kernels[frame]
+
+def frame_size(freqs: np.ndarray, freqs2: np.ndarray, length: int, rate: int =44100) -> int:
+    '''
+    Largest power of two frame (up to FRAME) whose constant-frequency frames keep the
+    phase error of the fastest glide under PHASE_ERR radians
+    '''
+    slope = np.max(np.abs(np.asarray(freqs2) - np.asarray(freqs)), initial=0.0) / max(length-1, 1)
+    frame = FRAME
+    # phase drift at the frame edge is pi*slope*(frame/2)**2/rate
+    while frame > MIN_FRAME and np.pi*slope*(frame/2.0)**2/rate > PHASE_ERR:
+        frame //= 2
+    return frame
+
+def partials(freqs: np.ndarray, freqs2: np.ndarray, amps: np.ndarray, length: int,
+             rate: int =44100) -> np.ndarray:
+    '''
+    Sum of sine partials, each gliding linearly in frequency from freqs to freqs2
+
+    Args:
+        freqs: ndarray -> starting frequency of each partial Hz
+        freqs2: ndarray -> ending frequency of each partial Hz (same as freqs for no gliss)
+        amps: ndarray -> amplitude of each partial
+        length: int -> number of samples
+        rate: int -> sample rate Hz
+    Returns:
+        float32 ndarray of length samples, matching the phase of notes.sine/notes.gliss_sine
+    I/O:
+        None
+    '''
+    freqs = np.asarray(freqs, dtype=np.float64)
+    freqs2 = np.asarray(freqs2, dtype=np.float64)
+    amps = np.asarray(amps, dtype=np.float64)
+    if freqs.shape != freqs2.shape or freqs.shape != amps.shape or freqs.ndim != 1:
+        raise SpectralError
+    if length <= 0:
+        return np.zeros((0,), dtype=np.float32)
+
+    frame = frame_size(freqs, freqs2, length, rate)
+    hop = frame // 2
+    nframes = -(-length // hop) + 1
+    slope = (freqs2 - freqs) / max(length-1, 1)
+
+    # frames are built a chunk at a time, so the (frames, partials, bins) spectra and the
+    # (frames, frame) inverse stay under CHUNK_CELLS whatever the length or number of partials
+    step = max(min(CHUNK_CELLS // (len(freqs) * (2*BINS+1)), CHUNK_CELLS // frame), 1)
+    out = np.empty(((nframes-1)*hop,), dtype=np.float32)
+    for first in range(0, nframes-1, step):
+        last = min(first+step, nframes-1)
+        frames = _frames(freqs, slope, amps, np.arange(first, last+1), frame, rate)
+        # Hann windows at half overlap sum to one, so overlap-add needs no normalisation
+        out[first*hop:last*hop] = (frames[1:, :hop] + frames[:-1, hop:]).ravel()
+    return out[:length]
+
+def _frames(freqs: np.ndarray, slope: np.ndarray, amps: np.ndarray, idx: np.ndarray,
+            frame: int, rate: int) -> np.ndarray:
+    '''
+    inverse FFT of the frames at indices idx, frame j covers samples [(j-1)*hop, (j+1)*hop)
+    and its centre is sample j*hop
+    '''
+    hop = frame // 2
+    nbins = hop + 1
+    nframes = len(idx)
+
+    centre = (idx * hop).astype(np.float64)[:, None]
+    # gliss_sine phase is 2*pi*n*linspace(f, (f+f2)/2)/rate, its derivative glides f -> f2
+    phase = 2*np.pi * centre * (freqs + slope*centre/2.0) / rate - np.pi/2.0
+    inst = np.maximum(freqs + slope*centre, 0.0)
+    amp = np.where(inst < rate/2.0, amps, 0.0)
+
+    # zero-phase frames have a real window transform, (-1)**bin moves the centre to frame/2
+    kappa = inst * frame / rate
+    near = np.rint(kappa)
+    pos = (kappa - near + 0.5) * OVERSAMPLE
+    low = np.minimum(pos.astype(np.int64), OVERSAMPLE-1)
+    frac = (pos - low)[..., None]
+    table = _kernel(frame)
+    kern = (1.0-frac)*table[low] + frac*table[low+1]
+
+    bins = near.astype(np.int64)[..., None] + np.arange(-BINS, BINS+1)
+    sign = 1.0 - 2.0*(bins & 1)
+    spec = ((amp/2.0) * np.exp(1j*phase))[..., None] * sign * kern
+
+    # bins outside 0..frame/2 belong to the mirrored negative frequencies of a real signal
+    mirror = (bins < 0) | (bins > hop)
+    spec = np.where(mirror, np.conj(spec), spec)
+    bins = np.where(bins < 0, -bins, np.where(bins > hop, frame-bins, bins))
+    edge = (bins == 0) | (bins == hop)
+    spec = np.where(edge, 2.0*spec.real, spec)
+    keep = (bins >= 0) & (bins <= hop)
+    spec = np.where(keep, spec, 0.0)
+    bins = np.clip(bins, 0, hop)
+
+    flat = (bins + (np.arange(nframes) * nbins)[:, None, None]).ravel()
+    size = nframes * nbins
+    frames = (np.bincount(flat, spec.real.ravel(), size) +
+              1j*np.bincount(flat, spec.imag.ravel(), size)).reshape(nframes, nbins)
+    return np.fft.irfft(frames, frame, axis=1)
+
+def benchmark(counts: list =(1, 2, 4, 8, 16, 32, 64), dur: float =2.0,
+              rate: int =44100, glide: float =1.0) -> list:
+    '''
+    Times summing notes.sine (or notes.gliss_sine) per partial against partials()
+    for numbers of partials
+
+    Args:
+        counts: list -> numbers of partials, fundamental included
+        dur: float -> seconds of audio per measurement
+        rate: int -> sample rate Hz
+        glide: float -> ratio of end to start frequency, 1.0 for constant frequency
+    Returns:
+        list of (partials, time domain seconds, spectral seconds, spectral frame size)
+    I/O:
+        None
+    '''
+    from . import notes
+
+    results = []
+    for count in counts:
+        freqs = 110.0 * np.arange(1, count+1)
+        amps = notes.VOLU * 0.5 / np.arange(1, count+1)
+        length = len(np.arange(rate*dur))
+        t0 = time.perf_counter()
+        wave = np.zeros((length,), dtype=np.float32)
+        for freq, amp in zip(freqs, amps):
+            if glide == 1.0:
+                wave += notes.sine(freq, dur, amp/notes.VOLU, rate)
+            else:
+                wave += notes.gliss_sine(freq, dur, amp/notes.VOLU, rate, [], freq*glide)
+        t1 = time.perf_counter()
+        partials(freqs, freqs*glide, amps, length, rate)
+        t2 = time.perf_counter()
+        results.append((count, t1 - t0, t2 - t1, frame_size(freqs, freqs*glide, length, rate)))
+
+    return results
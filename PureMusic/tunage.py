@@ -1,12 +1,41 @@
 #!/usr/bin/env python
+import functools
+import numpy as np
+
+class TuneError(Exception):
+    pass
+
+def _out(arr):
+    ''' float for scalar results, ndarray otherwise '''
+    return arr if arr.ndim else float(arr)
 
 class EqTemp(object):
-    ''' Creates Equal Temperament obj to be called '''
+    ''' Creates Equal Temperament obj to be called, tones and octs may be ndarrays '''
     def __init__(self, tone_p_oct: int =12, z00: float =16.35):
+        if tone_p_oct <= 0:
+            raise TuneError('tones per octave must be positive, not {}'.format(tone_p_oct))
         self.tpo = tone_p_oct
         self.z00 = z00
-    def __call__(self, tone: int, oct: int) -> float:
-        return (2**(tone/self.tpo)) * (2**oct) * self.z00
+        # the table only covers whole numbers of tones per octave
+        self.table = None
+        if float(tone_p_oct).is_integer():
+            self.table = z00 * np.exp2(np.arange(int(tone_p_oct)) / tone_p_oct)
+    def __call__(self, tone, oct):
+        tone = np.asarray(tone)
+        oct = np.asarray(oct)
+        if self.table is not None and np.issubdtype(tone.dtype, np.integer):
+            octs, idx = np.divmod(tone, len(self.table))
+            return _out(self.table[idx] * np.exp2(oct + octs))
+        return _out(np.exp2(tone / self.tpo) * np.exp2(oct) * self.z00)
+
+def temperament(tone_p_oct: int =12, z00: float =16.35) -> EqTemp:
+    ''' Shared EqTemp, so each temperament's table is only built once '''
+    # defaults and keywords are passed on positionally, so they share a cache entry
+    return _temperament(tone_p_oct, float(z00))
+
+@functools.lru_cache(maxsize=None)
+def _temperament(tone_p_oct, z00: float) -> EqTemp:
+    return EqTemp(tone_p_oct, z00)
 
-def teiltone(von: float, partial: int, oct: int =0) -> float:
-    return von * partial * (2**oct)
+def teiltone(von, partial, oct=0):
+    return _out(np.multiply(von, partial) * np.exp2(oct))
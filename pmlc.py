@@ -3,7 +3,13 @@ import os
 import sys
 import json
 import argparse
+import numpy as np
+try:
+    import resource
+except ImportError:
+    resource = None
 import PureMusic
+from PureMusic import pipeline
 
 VERSION = 'PureMusic version 0.0.3\n    Build date: 2020-14-08'
 
@@ -14,9 +20,11 @@ export to wav for '.pmusic' as well
 
 Modes:
 (default) -c, --compile: compiles into .pmusic file, which can be played [PML]
--w, --wave: exports to .wav file [PMUSIC, PML]
+-w, --wave: exports to .wav file, parsing, synthesizing, mixing and writing at once [PMUSIC, PML]
 -p, --play: plays audio from file [PMUSIC, PML]
 -g, --generate: creates new project in current directory []
+-e, --estimate: reports samples, memory and time needed to export, without rendering [PMUSIC, PML]
+--calibrate: times this machine and writes a calibration .json for --estimate []
 
 Can use '.json' as specifiers for overtones, must be included in compilation [PML]
 '''
@@ -32,27 +40,69 @@ class CLIArgumentError(Exception):
 class PMLError(Exception):
     pass
 
-def pmusic_play(path: str) -> None:
+def parse_bytes(txt: str) -> int:
+    '''
+    Converts a size such as '512M' or '2G' (or plain bytes) to bytes
+    '''
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+    txt = txt.strip().upper().rstrip('B')
+    try:
+        if txt and txt[-1] in units:
+            return int(float(txt[:-1]) * units[txt[-1]])
+        return int(txt)
+    except ValueError:
+        raise argparse.ArgumentTypeError('could not understand size {}'.format(txt))
+
+def report_memory(stats: dict) -> None:
+    '''
+    Prints peak bytes tracked while rendering, and peak resident memory of this process,
+    only when a memory budget was given, warning if the budget could not be kept
+
+    Args:
+        stats: dict -> from Score.memory_stats or PureMusic.pipeline.export
+    Returns:
+        None
+    I/O:
+        prints to stdout
+    '''
+    if stats['max_memory'] is None:
+        return
+    print('Peak memory tracked: {:.1f} MiB'.format(stats['peak_bytes'] / 2**20))
+    if stats['over_budget']:
+        print('Warning: the memory budget of {:.1f} MiB could not be kept, the longest notes '
+              'need more'.format(stats['max_memory'] / 2**20))
+    if resource is not None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 2**10
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        print('Peak resident memory: {:.1f} MiB'.format(rss / 2**20))
+
+def pmusic_play(path: str, max_memory=None) -> None:
     '''
     Given a path to a valid pmusic file, will open and play
 
     Args:
         path: str -> a path to .pmusic file
+        max_memory: None or int -> memory budget of the score in bytes
     Returns:
         None 
     I/O:
         loads file at path
     '''
-    score = PureMusic.load(path)
+    score = PureMusic.load(path, max_memory=max_memory)
     PureMusic.play(score)
+    report_memory(score.memory_stats())
 
-def pmusic_wav(path: str, output=None) -> None:
+def pmusic_wav(path: str, output=None, normalize=None, limit=None, max_memory=None) -> None:
     '''
     Given a path to a valid pmusic file, will open and export to output.wav
 
     Args:
         path: str -> a path to .pmusic file
         output: None or str -> output destination of .wav
+        normalize: None or float -> peak to normalize to
+        limit: None or float -> ceiling of look-ahead limiter
+        max_memory: None or int -> memory budget in bytes
     Returns:
         None
     I/O:
@@ -62,8 +112,30 @@ def pmusic_wav(path: str, output=None) -> None:
     if not dest.endswith(WAV_EXT):
         dest += WAV_EXT
 
-    score = PureMusic.load(path)
-    score.export(dest)
+    if normalize is not None:
+        score = PureMusic.load(path, max_memory=max_memory)
+        score.export(dest, normalize=normalize, limit=limit)
+        report_memory(score.memory_stats())
+    else:
+        report_memory(pipeline.export(pmusic_notes(path), dest, limit=limit,
+                                      max_memory=max_memory))
+
+def pmusic_notes(path: str):
+    '''
+    Generator for PureMusic.pipeline.export, of the sample rate then notes of a pmusic file
+    Every note is parsed and sorted by start before the first is yielded
+
+    Args:
+        path: str -> a path to .pmusic file
+    Returns:
+        generator of rate, then note dicts in order of start
+    I/O:
+        loads file at path
+    '''
+    score = PureMusic.load(path, specs=True)
+    yield score.rate
+    for note in sorted(score.notes_j, key=lambda note: note['start']):
+        yield note
 
 def from_TET(*args) -> float:
     '''
@@ -76,10 +148,17 @@ def from_TET(*args) -> float:
     I/O:
         None
     '''
+    tpo, z00, tone, oct = tet_args(*args)
+    return PureMusic.temperament(tpo, z00)(tone, oct)
+
+def tet_args(*args) -> tuple:
+    '''
+    Converts TET command arguments to (tones per octave, z00, tone, oct)
+    '''
     if len(args) == 3:
-        return PureMusic.EqTemp(int(args[0]))(int(args[1]), int(args[2]))
+        return int(args[0]), 16.35, int(args[1]), int(args[2])
     elif len(args) == 4:
-        return PureMusic.EqTemp(int(args[0]), float(args[1]))(int(args[2]), int(args[3]))
+        return int(args[0]), float(args[1]), int(args[2]), int(args[3])
     else:
         raise PMLError('TET takes 3 or 4 arguments, {} provided'.format(len(args)))
 
@@ -110,6 +189,108 @@ def from_OVT(txt: str) -> float:
     else:
         raise PMLError('OVT takes 2 or 3 arguments, {} provided'.format(len(remain)+1))
 
+def parse_freq(txt: str) -> tuple:
+    '''
+    Splits a frequency string into its arguments without calculating it
+
+    Args:
+        txt: str -> 'TET ...' or 'OVT ...' frequency string
+    Returns:
+        ('TET', tet) or ('OVT', base, partial, oct), where tet is from tet_args and
+        base is a float or a tet
+    I/O:
+        None
+    '''
+    if txt.startswith('TET '):
+        return ('TET', tet_args(*txt[4:].split()))
+
+    elif txt.startswith('OVT '):
+        txt = txt[4:]
+        if txt.startswith('(TET '):
+            base = tet_args(*txt[4:txt.index(')')].split())
+            remain = txt[txt.index(')')+1:].split()
+        else:
+            spl = txt.split(maxsplit=1)
+            base = float(spl[0])
+            remain = spl[1].split()
+
+        if len(remain) == 1:
+            return ('OVT', base, int(remain[0]), 0)
+        elif len(remain) == 2:
+            return ('OVT', base, int(remain[0]), int(remain[1]))
+        else:
+            raise PMLError('OVT takes 2 or 3 arguments, {} provided'.format(len(remain)+1))
+
+    else:
+        raise PMLError('{} string could not be parsed'.format(txt))
+
+def freq_collect(nto_obj, key, refs: list) -> None:
+    '''
+    Records where a frequency string is, so it can be resolved by resolve_freqs
+
+    Args:
+        nto_obj: dict or list -> representation of trill or note PureMusic objs
+        key: int or str -> key in nto_obj to 'freq' type arg
+        refs: list -> (nto_obj, key) pairs holding frequency strings, appended to
+    Returns:
+        None
+    I/O:
+        None
+    '''
+    if any((isinstance(nto_obj, dict) and key in nto_obj and isinstance(nto_obj[key], str),
+            isinstance(nto_obj, list) and len(nto_obj) > key and isinstance(nto_obj[key], str))):
+        refs.append((nto_obj, key))
+
+def resolve_freqs(refs: list) -> None:
+    '''
+    Resolves all collected frequency strings at once
+    Identical strings are parsed once, TET tones are calculated in one call per temperament
+    and OVT tones in one call to PureMusic.teiltone
+
+    Args:
+        refs: list -> (nto_obj, key) pairs from freq_collect, updated in place
+    Returns:
+        None
+    I/O:
+        None
+    '''
+    exprs = {}
+    for nto_obj, key in refs:
+        if nto_obj[key] not in exprs:
+            exprs[nto_obj[key]] = parse_freq(nto_obj[key])
+
+    tets = {}
+    for expr in exprs.values():
+        if isinstance(expr[1], tuple):
+            tets.setdefault(expr[1][:2], {})[expr[1][2:]] = None
+
+    tet_freqs = {}
+    for (tpo, z00), tones in tets.items():
+        tones = list(tones)
+        freqs = PureMusic.temperament(tpo, z00)(np.array([t[0] for t in tones], dtype=np.int64),
+                                                np.array([t[1] for t in tones], dtype=np.int64))
+        for tone, freq in zip(tones, np.atleast_1d(freqs).tolist()):
+            tet_freqs[(tpo, z00) + tone] = freq
+
+    values = {}
+    ovts = []
+    for txt, expr in exprs.items():
+        if expr[0] == 'TET':
+            values[txt] = tet_freqs[expr[1]]
+        else:
+            ovts.append((txt, tet_freqs[expr[1]] if isinstance(expr[1], tuple) else expr[1],
+                         expr[2], expr[3]))
+
+    if ovts:
+        freqs = PureMusic.teiltone(np.array([o[1] for o in ovts], dtype=np.float64),
+                                   np.array([o[2] for o in ovts], dtype=np.int64),
+                                   np.array([o[3] for o in ovts], dtype=np.int64))
+        for ovt, freq in zip(ovts, np.atleast_1d(freqs).tolist()):
+            values[ovt[0]] = freq
+
+    for nto_obj, key in refs:
+        nto_obj[key] = values[nto_obj[key]]
+
 def freq_parse(nto_obj, key) -> None:
     '''
     Parses strings for frequency related keys
@@ -212,22 +393,70 @@ def parse_trill_list(note: list, packages: dict) -> tuple:
 
     return note, outdict
 
-def pml_to_score(pml, packages: dict) -> PureMusic.Score:
+def pml_to_score(pml, packages: dict, specs: bool =False, max_memory=None) -> PureMusic.Score:
     '''
     Converts pml (or .json) fileobj into PureMusic.Score object
 
     Args:
         pml: IO-readable -> pml readable file in json format
         packages: dict -> dictionary of packages used in this project
+        specs: bool -> if True, returns a PureMusic.SpecScore with no notes synthesized
+        max_memory: None or int -> memory budget of the score in bytes
     Returns:
         score: PureMusic.Score -> score object loaded from pml
     I/O:
         loads json from pml fileobj
     '''
-    loaded = json.load(pml)
+    return loaded_to_score(json.load(pml), packages, specs, max_memory)
+
+def pml_notes(path: str, packages: dict):
+    '''
+    Generator for PureMusic.pipeline.export, of the sample rate then notes of a pml file
+    Every note is parsed and sorted by start before the first is yielded
+
+    Args:
+        path: str -> path to .pml (or .json)
+        packages: dict -> dictionary of packages used in this project
+    Returns:
+        generator of rate, then note dicts in order of start
+    I/O:
+        loads json from path
+    '''
+    with open(path, 'r') as pml:
+        loaded = json.load(pml)
+    yield loaded.get('rate') or 44100
+
+    score = loaded_to_score(loaded, packages, specs=True)
+    for note in sorted(score.notes_j, key=lambda note: note['start']):
+        yield note
+
+def loaded_to_score(loaded: dict, packages: dict, specs: bool =False,
+                    max_memory=None) -> PureMusic.Score:
+    '''
+    Converts pml loaded as json into PureMusic.Score object
+
+    Args:
+        loaded: dict -> pml file loaded with json.load
+        packages: dict -> dictionary of packages used in this project
+        specs: bool -> if True, returns a PureMusic.SpecScore with no notes synthesized
+        max_memory: None or int -> memory budget of the score in bytes
+    Returns:
+        score: PureMusic.Score -> score object of loaded
+    I/O:
+        None
+    '''
     rate = loaded.get('rate') or 44100
     title = loaded.get('title') or 'untitled'
-    score = PureMusic.Score(rate, title)
+    score = (PureMusic.SpecScore if specs else PureMusic.Score)(rate, title, max_memory)
+
+    refs = []
+    for note in loaded.get('notes', []):
+        for key in (('freq', 'freq2') if isinstance(note, dict) else (0,)):
+            freq_collect(note, key, refs)
+    for trill in loaded.get('trills', []):
+        for key in (('freq1', 'freq2') if isinstance(trill, dict) else (0, 1)):
+            freq_collect(trill, key, refs)
+    resolve_freqs(refs)
 
     if 'notes' in loaded:
         for note in loaded['notes']:
@@ -312,13 +541,16 @@ def compile_(paths: list, output: str) -> None:
     else:
         raise CLIArgumentError('File {} of unsupported format'.format(paths[0]))
 
-def wave_(paths: list, output: str) -> None:
+def wave_(paths: list, output: str, normalize=None, limit=None, max_memory=None) -> None:
     '''
     Exports pml or pmusic to .wav file
 
     Args:
         paths: list -> list of paths to pml followed by json packages or to pmusic file
         output: str -> output path to .wav
+        normalize: None or float -> peak to normalize to
+        limit: None or float -> ceiling of look-ahead limiter
+        max_memory: None or int -> memory budget in bytes
     Returns:
         None
     I/O:
@@ -328,28 +560,36 @@ def wave_(paths: list, output: str) -> None:
         if len(paths) > 1:
             raise CLIArgumentError('Too many files provided')
         else:
-            pmusic_wav(paths[0], output)
+            pmusic_wav(paths[0], output, normalize, limit, max_memory)
 
     elif paths[0].endswith(PML_EXT) or paths[0].endswith(JSON_EXT):
         if len(paths) > 1:
             pkg = unpack_pkgs(paths[1:])
         else:
             pkg = {}
-        with open(paths[0], 'r') as pml:
-            score = pml_to_score(pml, pkg)
-        
-        score.export(output)
+        dest = output or os.path.splitext(paths[0])[0]
+
+        # normalizing needs the peak of the whole mix, so cannot be streamed
+        if normalize is not None:
+            with open(paths[0], 'r') as pml:
+                score = pml_to_score(pml, pkg, max_memory=max_memory)
+            score.export(dest, normalize=normalize, limit=limit)
+            report_memory(score.memory_stats())
+        else:
+            report_memory(pipeline.export(pml_notes(paths[0], pkg), dest, limit=limit,
+                                          max_memory=max_memory))
 
     else:
         raise CLIArgumentError('File {} of unsupported format'.format(paths[0]))
 
-def play_(paths: list, output: str) -> None:
+def play_(paths: list, output: str, max_memory=None) -> None:
     '''
     Reads .pml or .pmusic, and plays music to speakers
 
     Args:
         paths: list -> list of paths to .pml, .json packages or .pmusic
         output: str -> path to output, unused in this case (makes main easier to use)
+        max_memory: None or int -> memory budget of the score in bytes
     Returns:
         None
     I/O:
@@ -359,7 +599,7 @@ def play_(paths: list, output: str) -> None:
         if len(paths) > 1:
             raise CLIArgumentError('Too many files provided')
         else:
-            pmusic_play(paths[0])
+            pmusic_play(paths[0], max_memory)
 
     elif paths[0].endswith(PML_EXT) or paths[0].endswith(JSON_EXT):
         if len(paths) > 1:
@@ -367,13 +607,76 @@ def play_(paths: list, output: str) -> None:
         else:
             pkg = {}
         with open(paths[0], 'r') as pml:
-            score = pml_to_score(pml, pkg)
+            score = pml_to_score(pml, pkg, max_memory=max_memory)
 
         PureMusic.play(score)
+        report_memory(score.memory_stats())
+
+    else:
+        raise CLIArgumentError('File {} of unsupported format'.format(paths[0]))
+
+def estimate_(paths: list, output: str, calibration=None, normalize=None,
+              max_memory=None) -> None:
+    '''
+    Reads .pml or .pmusic note specs and reports the cost of exporting them with -w,
+    which streams them through PureMusic.pipeline unless normalizing
+
+    Args:
+        paths: list -> list of paths to .pml, .json packages or .pmusic
+        output: None or str -> path to write the report as .json, printed if None
+        calibration: None or str -> path to calibration .json from --calibrate
+        normalize: None or float -> peak to normalize to, which renders a whole Score
+        max_memory: None or int -> memory budget in bytes
+    Returns:
+        None
+    I/O:
+        Reads from all provided files, writes report to output or stdout
+    '''
+    if paths[0].endswith(PMUSIC_EXT):
+        if len(paths) > 1:
+            raise CLIArgumentError('Too many files provided')
+        else:
+            score = PureMusic.load(paths[0], specs=True, max_memory=max_memory)
+
+    elif paths[0].endswith(PML_EXT) or paths[0].endswith(JSON_EXT):
+        if len(paths) > 1:
+            pkg = unpack_pkgs(paths[1:])
+        else:
+            pkg = {}
+        with open(paths[0], 'r') as pml:
+            score = pml_to_score(pml, pkg, specs=True, max_memory=max_memory)
 
     else:
         raise CLIArgumentError('File {} of unsupported format'.format(paths[0]))
 
+    calib = PureMusic.load_calibration(calibration) if calibration else None
+    report = score.estimate(calib, streamed=normalize is None)
+
+    if output:
+        with open(output, 'w') as out:
+            json.dump(report, out, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+def calibrate_(paths: list, output: str) -> None:
+    '''
+    Times synthesis on this machine and writes a calibration for --estimate
+
+    Args:
+        paths: list -> unused
+        output: None or str -> path to calibration .json, defaults to calibration.json
+    Returns:
+        None
+    I/O:
+        writes calibration using json.dump
+    '''
+    dest = output or 'calibration'
+    if not dest.endswith(JSON_EXT):
+        dest += JSON_EXT
+
+    with open(dest, 'w') as out:
+        json.dump(PureMusic.calibrate(), out, indent=4)
+
 def gen_(paths: list, output: str) -> None:
     '''
     Generates a starter project to get going
@@ -429,6 +732,24 @@ def main():
                         '--generate',
                         help='Generates new pml project in current directory',
                         action='store_true')
+    parser.add_argument('-e',
+                        '--estimate',
+                        help='Report samples, memory and time needed to render\nSupported extensions: [.pml, .pmusic]',
+                        action='store_true')
+    parser.add_argument('--calibrate',
+                        help='Time this machine and write a calibration .json for --estimate',
+                        action='store_true')
+    parser.add_argument('--calibration',
+                        help='Path of calibration .json used by --estimate')
+    parser.add_argument('--normalize',
+                        help='Peak to normalize .wav export to, e.g. 0.99',
+                        type=float)
+    parser.add_argument('--limit',
+                        help='Ceiling of look-ahead limiter on .wav export, e.g. 0.99',
+                        type=float)
+    parser.add_argument('--max-memory',
+                        help='Memory budget for rendering, e.g. 512M, reports peak usage\nSupported modes: [-w, -p, -e]',
+                        type=parse_bytes)
     parser.add_argument('paths',
                         help='Paths to accepted file types',
                         nargs='*')
@@ -442,20 +763,31 @@ def main():
 
     mode = compile_
 
-    if any((args.wave, args.compile, args.play, args.generate)):
-        if args.wave and not any((args.compile, args.play, args.generate)):
+    modes = (args.wave, args.compile, args.play, args.generate, args.estimate, args.calibrate)
+    if any(modes):
+        if sum(modes) > 1:
+            raise CLIArgumentError('Cannot specify multiple modes')
+        elif args.wave:
             mode = wave_
-        elif args.play and not any((args.compile, args.wave, args.generate)):
+        elif args.play:
             mode = play_
-        elif args.compile and not any((args.play, args.wave, args.generate)):
+        elif args.compile:
             mode = compile_
-        elif args.generate and not any((args.play, args.compile, args.wave)):
+        elif args.generate:
             mode = gen_
+        elif args.estimate:
+            mode = estimate_
         else:
-            raise CLIArgumentError('Cannot specify multiple modes')
+            mode = calibrate_
 
-    if len(args.paths) < 1 and mode != gen_:
+    if len(args.paths) < 1 and mode not in (gen_, calibrate_):
         raise CLIArgumentError('No files provided')
+    elif mode == estimate_:
+        mode(args.paths, args.output, args.calibration, args.normalize, args.max_memory)
+    elif mode == wave_:
+        mode(args.paths, args.output, args.normalize, args.limit, args.max_memory)
+    elif mode == play_:
+        mode(args.paths, args.output, args.max_memory)
     else:
         mode(args.paths, args.output)
 
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+import tracemalloc
+import pytest
+import PureMusic
+from PureMusic import cost
+from PureMusic import pipeline
+from PureMusic.score import render_note
+
+NOTES = [
+    {'freq': 440.0, 'dur': 0.3, 'vol': 0.5, 'start': 0.1},
+    {'freq': 330.0, 'dur': 0.25, 'vol': 0.5, 'start': 0.2, 'wave': 'any_acc',
+     'over': [[2, 0.5], [3, 0.25]]},
+    {'freq': 220.0, 'dur': 0.5, 'vol': 0.5, 'start': 0.4, 'wave': 'gliss_sine_acc',
+     'over': [[2, 0.5]], 'freq2': 330.0},
+]
+
+def build(cls=PureMusic.Score) -> PureMusic.Score:
+    score = cls()
+    for note in NOTES:
+        score.add(**note)
+    return score
+
+def test_samples_match_render():
+    score = build()
+    report = build(PureMusic.SpecScore).estimate()
+
+    assert report['total_samples'] == len(score.render()) // 4
+    for note_j in score.notes_j:
+        assert cost.note_samples(note_j, score.rate) == len(render_note(note_j, score.rate))
+    synth = {}
+    for note_j in score.notes_j:
+        parts = 1 + len(note_j['over']) if note_j['wave'] in cost.PARTIAL_WAVES else 1
+        synth[note_j['wave']] = synth.get(note_j['wave'], 0) + \
+            parts * len(render_note(note_j, score.rate))
+    assert report['synth_samples'] == synth
+
+def test_estimate_counts_bytes():
+    score = build()
+    score.render()
+    report = score.estimate()
+    stats = score.memory_stats()
+
+    assert report['note_bytes'] == stats['note_bytes']
+    assert report['canvas_bytes'] == len(score.render())
+    assert report['peak_bytes'] >= stats['peak_bytes']
+    assert 0.0 < report['render_seconds'] < report['export_seconds']
+
+def test_spec_score_edits():
+    score = build(PureMusic.SpecScore)
+    assert score.remove(2)['wave'] == 'gliss_sine_acc'
+    assert score.end == pytest.approx(0.45)
+    score.replace(0, dur=0.6)
+    score.shift(1, 0.5)
+    assert score.end == pytest.approx(0.95)
+    assert score.notes_j[1]['start'] == pytest.approx(0.7)
+    with pytest.raises(PureMusic.ScoreError):
+        score.replace(0, start=-1.0)
+    with pytest.raises(PureMusic.ScoreError):
+        score.render()
+
+def test_calibrate():
+    calib = PureMusic.calibrate(dur=0.1)
+    assert set(calib) == set(cost.CALIBRATION)
+    assert set(calib['wave']) == set(cost.CALIBRATION['wave'])
+    assert all(val > 0.0 for val in calib['wave'].values())
+    assert build(PureMusic.SpecScore).estimate(calib)['render_seconds'] > 0.0
+
+def test_load_calibration_fills_defaults(tmp_path):
+    path = tmp_path / 'calibration.json'
+    path.write_text('{"mix": 1.0, "wave": {"sine": 2.0}}')
+    calib = PureMusic.load_calibration(str(path))
+    assert calib['mix'] == 1.0
+    assert calib['wave']['sine'] == 2.0
+    assert calib['wave']['ramp'] == cost.CALIBRATION['wave']['ramp']
+    assert calib['note'] == cost.CALIBRATION['note']
+
+@pytest.mark.parametrize('note', [
+    {'freq': 440.0, 'dur': 2.0, 'vol': 0.5, 'wave': 'gliss_sine', 'freq2': 660.0},
+    {'freq': 110.0, 'dur': 2.0, 'vol': 0.5, 'wave': 'gliss_sine_acc', 'freq2': 165.0,
+     'over': [[partial, 0.5/partial] for partial in range(2, 33)]},
+])
+def test_estimate_covers_note_temporaries(note):
+    score = PureMusic.SpecScore()
+    score.add(**note)
+    report = score.estimate()
+
+    tracemalloc.start()
+    render_note(score.notes_j[0], score.rate)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak <= report['peak_bytes'] - report['canvas_bytes']
+
+def test_streamed_estimate_covers_pipeline(tmp_path):
+    score = PureMusic.SpecScore()
+    for idx in range(40):
+        score.add(220.0 + 10*idx, 1.0, 0.3, start=0.5*idx)
+    stats = pipeline.export(iter([score.rate] + score.notes_j), str(tmp_path / 'out.wav'))
+
+    streamed = score.estimate(streamed=True)
+    assert streamed['streamed']
+    assert streamed['peak_bytes'] >= stats['peak_bytes']
+    # no canvas, and only the notes queued between stages
+    assert streamed['peak_bytes'] < score.estimate()['peak_bytes']
+
+@pytest.mark.parametrize('max_memory', [10**7, 300000, 100000])
+def test_estimate_covers_budgeted_render(tmp_path, max_memory):
+    score = PureMusic.Score(max_memory=max_memory)
+    for note in NOTES:
+        score.add(**note)
+    score.render(normalize=0.9)
+    report = score.estimate()
+    assert report['max_memory'] == max_memory
+    assert report['peak_bytes'] >= score.memory_stats()['peak_bytes']
+    assert report['peak_bytes'] <= build(PureMusic.SpecScore).estimate()['peak_bytes']
+
+    stats = pipeline.export(iter([score.rate] + score.notes_j), str(tmp_path / 'out.wav'),
+                            max_memory=max_memory)
+    streamed = score.estimate(streamed=True)
+    assert streamed['peak_bytes'] >= stats['peak_bytes']
+    assert not stats['over_budget']
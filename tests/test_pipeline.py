@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+import wave
+import numpy as np
+import pytest
+import PureMusic
+from PureMusic import pipeline
+
+def read_wav(path) -> np.ndarray:
+    with wave.open(str(path), 'rb') as wv:
+        return np.frombuffer(wv.readframes(wv.getnframes()), dtype='<i2').astype(np.int32)
+
+def sparse_score() -> PureMusic.Score:
+    ''' notes with silence before, between and after them '''
+    score = PureMusic.Score()
+    score.add(440.0, 0.3, 0.5, start=1.0)
+    score.add(550.0, 0.5, 0.5, start=2.5)
+    score.add(330.0, 0.2, 0.5, start=2.6)
+    return score
+
+def source(score: PureMusic.Score):
+    yield score.rate
+    for note in sorted(score.notes_j, key=lambda note: note['start']):
+        yield note
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_export_matches_score_export(tmp_path, workers):
+    score = sparse_score()
+    score.export(str(tmp_path / 'score.wav'))
+    pipeline.export(source(score), str(tmp_path / 'pipe.wav'), workers=workers)
+
+    expected = read_wav(tmp_path / 'score.wav')
+    got = read_wav(tmp_path / 'pipe.wav')
+    assert len(got) == len(expected) == int(score.end * score.rate)
+    assert np.flatnonzero(got)[0] == np.flatnonzero(expected)[0]
+    assert np.abs(got - expected).max() <= 1
+
+def test_export_limits_like_score_export(tmp_path):
+    score = sparse_score()
+    score.export(str(tmp_path / 'score.wav'), limit=0.05)
+    pipeline.export(source(score), str(tmp_path / 'pipe.wav'), limit=0.05)
+
+    assert np.abs(read_wav(tmp_path / 'pipe.wav') - read_wav(tmp_path / 'score.wav')).max() <= 1
+
+def test_export_rejects_unsorted_notes(tmp_path):
+    score = sparse_score()
+    notes = [score.rate] + score.notes_j[::-1]
+    with pytest.raises(pipeline.PipelineError):
+        pipeline.export(iter(notes), str(tmp_path / 'pipe.wav'))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+import pytest
+import pmlc
+
+FREQS = [
+    'TET 12 9 4',
+    'TET 12 -3 4',
+    'TET 12 21 3',
+    'TET 19 440.0 5 0',
+    'TET 12 16.35 9 4',
+    'OVT 110.0 3',
+    'OVT 110.0 3 -1',
+    'OVT (TET 12 9 4) 2',
+    'OVT (TET 19 440.0 5 0) 5 1',
+]
+
+def test_resolve_freqs_matches_freq_parse():
+    notes = [{'freq': txt, 'freq2': FREQS[-1-idx]} for idx, txt in enumerate(FREQS)]
+    trills = [[FREQS[idx], FREQS[idx-1], 1.0, 4, 0.5] for idx in range(len(FREQS))]
+
+    refs = []
+    for note in notes:
+        for key in ('freq', 'freq2'):
+            pmlc.freq_collect(note, key, refs)
+    for trill in trills:
+        for key in (0, 1):
+            pmlc.freq_collect(trill, key, refs)
+    pmlc.resolve_freqs(refs)
+
+    for idx, note in enumerate(notes):
+        expected = {'freq': FREQS[idx], 'freq2': FREQS[-1-idx]}
+        pmlc.freq_parse(expected, 'freq')
+        pmlc.freq_parse(expected, 'freq2')
+        assert note['freq'] == pytest.approx(expected['freq'], rel=1e-12)
+        assert note['freq2'] == pytest.approx(expected['freq2'], rel=1e-12)
+    for idx, trill in enumerate(trills):
+        expected = [FREQS[idx], FREQS[idx-1]]
+        pmlc.freq_parse(expected, 0)
+        pmlc.freq_parse(expected, 1)
+        assert trill[:2] == pytest.approx(expected, rel=1e-12)
+
+def test_resolve_freqs_rejects_bad_strings():
+    with pytest.raises(pmlc.PMLError):
+        pmlc.resolve_freqs([({'freq': 'ABC 12 9 4'}, 'freq')])
+    with pytest.raises(pmlc.PMLError):
+        pmlc.resolve_freqs([({'freq': 'TET 12 9'}, 'freq')])
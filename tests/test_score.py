@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+import wave
+import numpy as np
+import pytest
+import PureMusic
+
+def build(max_memory=None) -> PureMusic.Score:
+    ''' sparse score with a noise note, which is spilled rather than evicted '''
+    np.random.seed(0)
+    score = PureMusic.Score(max_memory=max_memory)
+    score.add(440.0, 0.3, 0.5, start=1.0)
+    score.add(0.0, 0.2, 0.5, start=1.2, wave='noise')
+    score.add(550.0, 0.5, 0.5, start=2.5)
+    score.add(330.0, 0.4, 0.5, start=2.6, wave='any_acc', over=[[2, 0.5], [3, 0.25]])
+    return score
+
+def samples(score: PureMusic.Score, **kws) -> np.ndarray:
+    return np.frombuffer(score.render(**kws), dtype=np.float32)
+
+# canvas and notes fit, notes are evicted to fit the canvas, chunked with every note held,
+# chunked with notes evicted, below the window and one note so the budget cannot be kept
+BUDGETS = [10**7, 700000, 500000, 300000, 100000]
+
+@pytest.mark.parametrize('max_memory', BUDGETS)
+def test_budgeted_render_matches(max_memory):
+    expected = samples(build())
+    got = samples(build(max_memory))
+    assert len(got) == len(expected)
+    assert np.abs(got - expected).max() < 1e-6
+
+@pytest.mark.parametrize('max_memory', BUDGETS)
+def test_budgeted_export_matches(tmp_path, max_memory):
+    build().export(str(tmp_path / 'full.wav'), normalize=0.9)
+    build(max_memory).export(str(tmp_path / 'budget.wav'), normalize=0.9)
+
+    with wave.open(str(tmp_path / 'full.wav'), 'rb') as full, \
+         wave.open(str(tmp_path / 'budget.wav'), 'rb') as budget:
+        assert budget.getnframes() == full.getnframes() == int(3.0 * 44100)
+        expected = np.frombuffer(full.readframes(full.getnframes()), dtype='<i2')
+        got = np.frombuffer(budget.readframes(budget.getnframes()), dtype='<i2')
+    assert np.abs(got.astype(np.int32) - expected).max() <= 1
+
+def test_budgeted_edits_match():
+    full = build()
+    budget = build(100000)
+    for score in (full, budget):
+        score.render()
+        score.remove(0)
+        score.replace(1, vol=0.2)
+        score.shift(0, 0.5)
+    assert np.abs(samples(budget) - samples(full)).max() < 1e-6
+
+@pytest.mark.parametrize('max_memory', BUDGETS[:-1])
+def test_budget_is_kept(tmp_path, max_memory):
+    score = build(max_memory)
+    assert score.memory_stats()['peak_bytes'] <= max_memory
+    score.render(normalize=0.9)
+    score.export(str(tmp_path / 'budget.wav'), limit=0.5)
+    score.replace(2, dur=0.6)
+    score.render()
+    assert score.memory_stats()['peak_bytes'] <= max_memory
+    assert not score.memory_stats()['over_budget']
+
+def test_budget_below_one_note_is_reported():
+    score = build(BUDGETS[-1])
+    score.render()
+    assert score.memory_stats()['over_budget']
+
+def test_chunked_keeps_notes_that_fit():
+    score = build(500000)
+    score.render()
+    stats = score.memory_stats()
+    assert stats['chunked']
+    assert stats['notes_held'] == len(score.notes_j)
+    assert stats['peak_bytes'] <= 500000
+
+def test_evicts_to_fit_canvas():
+    score = build(700000)
+    score.render()
+    stats = score.memory_stats()
+    assert not stats['chunked']
+    assert stats['notes_spilled'] + stats['notes_evicted'] > 0
+    assert stats['peak_bytes'] <= 700000
+
+def fresh(notes_j: list) -> np.ndarray:
+    score = PureMusic.Score()
+    for note_j in notes_j:
+        score.add(**note_j)
+    return samples(score)
+
+def test_edits_match_fresh_score():
+    score = PureMusic.Score()
+    # renders to one sample more than int(end*rate), cut off until the canvas grows
+    score.add(440.0, 0.1234, 0.5, attc=0.0, dec=0.0)
+    score.render()
+    score.add(330.0, 0.2, 0.5, start=0.3)
+    assert np.abs(samples(score) - fresh(score.notes_j)).max() < 1e-6
+
+    score.add(550.0, 0.2, 0.5, start=0.4, wave='any_acc', over=[[2, 0.5]])
+    score.remove(0)
+    assert np.abs(samples(score) - fresh(score.notes_j)).max() < 1e-6
+    score.replace(1, dur=0.3311, attc=0.0, dec=0.0)
+    assert np.abs(samples(score) - fresh(score.notes_j)).max() < 1e-6
+    score.shift(0, 0.5)
+    assert np.abs(samples(score) - fresh(score.notes_j)).max() < 1e-6
+    score.shift(0, -0.7)
+    assert np.abs(samples(score) - fresh(score.notes_j)).max() < 1e-6
+    score.remove(-1)
+    assert np.abs(samples(score) - fresh(score.notes_j)).max() < 1e-6
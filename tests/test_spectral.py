@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+import numpy as np
+import pytest
+from PureMusic import notes, spectral
+
+def over(count: int) -> list:
+    return [[partial, 0.5/partial] for partial in range(2, count+1)]
+
+def time_domain(wave, *args) -> np.ndarray:
+    spectral_partials = notes.SPECTRAL_PARTIALS
+    notes.SPECTRAL_PARTIALS = None
+    try:
+        return wave(*args)
+    finally:
+        notes.SPECTRAL_PARTIALS = spectral_partials
+
+@pytest.mark.parametrize('wave, freq, freq2, dur, count', [
+    (notes.any_acc, 220.0, 550.0, 1.0, 8),
+    (notes.any_acc, 110.0, 550.0, 2.0, 32),
+    (notes.gliss_sine_acc, 220.0, 220.0, 1.0, 8),
+    (notes.gliss_sine_acc, 220.0, 330.0, 2.0, 8),
+    (notes.gliss_sine_acc, 110.0, 220.0, 4.0, 32),
+])
+def test_spectral_matches_time_domain(wave, freq, freq2, dur, count):
+    args = (freq, dur, 0.5, 44100, over(count), freq2)
+    glide = freq2 if wave is notes.gliss_sine_acc else freq
+    assert notes._use_spectral(freq, glide, dur, 44100, over(count))
+
+    got = wave(*args)
+    expected = time_domain(wave, *args)
+    assert len(got) == len(expected)
+    assert np.abs(got - expected).max() < 2e-3
+
+def test_fast_glide_uses_time_domain():
+    assert not notes._use_spectral(220.0, 880.0, 2.0, 44100, over(8))
+    assert not notes._use_spectral(110.0, 4000.0, 10.0, 44100, over(32))
+    args = (220.0, 2.0, 0.5, 44100, over(8), 880.0)
+    assert np.array_equal(notes.gliss_sine_acc(*args), time_domain(notes.gliss_sine_acc, *args))
+
+def test_partials_short_frames_match_time_domain():
+    # 64 sample frames, across several chunks
+    freqs = 110.0 * np.arange(1, 9)
+    length = len(np.arange(44100*1.0))
+    assert spectral.frame_size(freqs, 16*freqs, length) == spectral.MIN_FRAME
+    got = spectral.partials(freqs, 16*freqs, notes.VOLU*0.5/np.arange(1, 9), length)
+
+    expected = np.zeros((length,), dtype=np.float32)
+    for partial, freq in enumerate(freqs, 1):
+        expected += notes.gliss_sine(freq, 1.0, 0.5/partial, 44100, [], 16*freq)
+    assert np.abs(got - expected).max() < 2e-3
+
+def test_benchmark_covers_glides():
+    count, time_s, spectral_s, frame = spectral.benchmark((8,), 0.2, glide=4.0)[0]
+    assert count == 8 and time_s > 0.0 and spectral_s > 0.0
+    assert frame < spectral.FRAME
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+import numpy as np
+import pytest
+import PureMusic
+
+def reference(tpo, z00, tone, oct) -> float:
+    ''' EqTemp before the tone table, one tone at a time '''
+    return (2**(tone/tpo)) * (2**oct) * z00
+
+@pytest.mark.parametrize('tpo', [12, 12.0, 19, 7.5, 1])
+def test_eqtemp_arrays_match_scalars(tpo):
+    eqt = PureMusic.EqTemp(tpo, 16.35)
+    tones = np.arange(-30, 40, dtype=np.int64)
+    octs = np.resize(np.arange(-1, 6, dtype=np.int64), len(tones))
+
+    freqs = eqt(tones, octs)
+    assert isinstance(freqs, np.ndarray) and freqs.shape == tones.shape
+    for tone, oct, freq in zip(tones.tolist(), octs.tolist(), freqs.tolist()):
+        assert isinstance(eqt(tone, oct), float)
+        assert eqt(tone, oct) == pytest.approx(freq, rel=1e-12)
+        assert freq == pytest.approx(reference(tpo, 16.35, tone, oct), rel=1e-12)
+    assert eqt(2.5, 4) == pytest.approx(reference(tpo, 16.35, 2.5, 4), rel=1e-12)
+
+@pytest.mark.parametrize('tpo', [0, -12, 0.0])
+def test_eqtemp_rejects_empty_octave(tpo):
+    with pytest.raises(PureMusic.TuneError):
+        PureMusic.EqTemp(tpo)
+    with pytest.raises(PureMusic.TuneError):
+        PureMusic.temperament(tpo)
+
+def test_temperament_shares_defaults():
+    assert PureMusic.temperament(12) is PureMusic.temperament(12, 16.35)
+    assert PureMusic.temperament(12) is PureMusic.temperament(tone_p_oct=12, z00=16.35)
+    assert PureMusic.temperament(12) is not PureMusic.temperament(12, 440.0)
+
+def test_teiltone_arrays_match_scalars():
+    vons = np.array([110.0, 261.63, 440.0])
+    partials = np.array([1, 3, 7])
+    octs = np.array([0, -1, 2])
+    freqs = PureMusic.teiltone(vons, partials, octs)
+    for von, partial, oct, freq in zip(vons, partials, octs, freqs):
+        assert PureMusic.teiltone(float(von), int(partial), int(oct)) == pytest.approx(freq)
+    assert isinstance(PureMusic.teiltone(110.0, 3), float)